@@ -1,43 +1,81 @@
-import psycopg2
+import argparse
 
-from .globals import POSTGRES_URL
+from .db import pool, refresh_views
 from .listchannels import listchannels
 from .inspectblocks import inspectblocks
 from .unknownclosetypes import unknownclosetypes
 from .listnodes import listnodes
-from .chain_analysis import chain_analysis
+from .chain_analysis import chain_analysis, THREADS
+from .rescan import rescan
+from .follow import follow
 
 
 def main():
-    with psycopg2.connect(POSTGRES_URL) as conn:
-        conn.autocommit = True
+    parser = argparse.ArgumentParser(prog="getdata")
+    commands = parser.add_subparsers(dest="command")
+    rescan_parser = commands.add_parser(
+        "rescan", help="rescan historical blocks for closes across many workers"
+    )
+    rescan_parser.add_argument("--workers", type=int, default=4)
+    rescan_parser.add_argument("--from", dest="start", type=int, default=506425)
+    rescan_parser.add_argument("--lease-size", type=int, default=1000)
+    rescan_parser.add_argument(
+        "--stall",
+        type=int,
+        default=600,
+        help="seconds without a heartbeat after which a lease is taken over",
+    )
+    rescan_parser.add_argument(
+        "--reset", action="store_true", help="forget the progress of a previous rescan"
+    )
+    follow_parser = commands.add_parser(
+        "follow", help="keep running, processing new blocks and gossip as they come"
+    )
+    follow_parser.add_argument(
+        "--poll", type=int, default=30, help="seconds between checks for a new tip"
+    )
+    follow_parser.add_argument(
+        "--gossip",
+        type=int,
+        default=600,
+        help="seconds between gossip downloads and node stats refreshes",
+    )
+    follow_parser.add_argument(
+        "--analysis",
+        type=int,
+        default=86400,
+        help="seconds between unknown close type rechecks and chain analysis",
+    )
+    args = parser.parse_args()
 
-        with conn.cursor() as db:
-            print("listing channels")
-            listchannels(db)
+    if args.command == "rescan":
+        rescan(args.workers, args.start, args.lease_size, args.stall, args.reset)
+    elif args.command == "follow":
+        follow(args.poll, args.gossip, args.analysis)
+    else:
+        routine()
 
-        with conn.cursor() as db:
-            print("rechecking unknown close types")
-            unknownclosetypes(db)
 
-        with conn.cursor() as db:
-            print("inspecting blocks")
-            inspectblocks(db)
+def routine():
+    # a single pool for the whole run, big enough for chain_analysis's threads
+    with pool(THREADS) as p:
+        print("listing channels")
+        listchannels(p)
 
-        with conn.cursor() as db:
-            print("inserting nodes")
-            listnodes(db)
+        print("rechecking unknown close types")
+        unknownclosetypes(p)
 
-        with conn.cursor() as db:
-            print("performing chain analysis")
-            chain_analysis(db)
+        print("inspecting blocks")
+        inspectblocks(p)
 
-        with conn.cursor() as db:
-            db.execute("REFRESH MATERIALIZED VIEW last_block")
-            db.execute("REFRESH MATERIALIZED VIEW implementations")
-            db.execute("REFRESH MATERIALIZED VIEW nodes")
-            db.execute("REFRESH MATERIALIZED VIEW globalstats")
-            db.execute("REFRESH MATERIALIZED VIEW closetypes")
+        print("inserting nodes")
+        listnodes(p)
 
+        print("performing chain analysis")
+        chain_analysis(p)
 
-main()
+        refresh_views(p)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,55 @@
-import psycopg2
 import random
-from multiprocessing import Process
+from threading import Thread
 
-from .globals import POSTGRES_URL
+from .db import cursor, stream, execute
 
+# groups of channels analyzed concurrently, each in a thread with its own
+# connection from the stage's pool, so the pool needs at least this many
+THREADS = 5
 
-def chain_analysis(db):
-    db.execute(
+
+def chain_analysis(p):
+    rows = stream(
+        p,
         """
 SELECT short_channel_id
 FROM channels
 WHERE close->>'block' IS NOT NULL
   AND (a IS NULL OR funder IS NULL)
 ORDER BY short_channel_id
-    """
+    """,
     )
 
     # this is not urgent work, but very demanding, split it across 20 days avg
-    rows = [row for row in db.fetchall() if random.random() < 0.05]
+    rows = [row for row in rows if random.random() < 0.05]
 
-    # also split it into 5 groups which we will put in 5 different processes
-    groups = ([], [], [], [], [])
+    # also split it into groups which we will put in different threads
+    # (the heavy work happens inside postgres, so threads are enough)
+    groups = tuple([] for _ in range(THREADS))
     for (scid,) in rows:
         for g, group in enumerate(groups):
             if int(scid.split("x")[0]) % len(groups) == g:
                 group.append(scid)
                 break
 
-    for group in groups:
-        p = Process(target=group_run_separate_process, args=(group,))
-        p.start()
+    threads = [Thread(target=group_run, args=(p, group)) for group in groups]
+    for thread in threads:
+        thread.start()
 
-    for group in groups:
-        p.join()
+    for thread in threads:
+        thread.join()
 
 
-def group_run_separate_process(scids):
-    with psycopg2.connect(POSTGRES_URL) as conn:
-        conn.autocommit = True
-        with conn.cursor() as db:
-            for scid in scids:
-                run_for_channel(db, scid)
+def group_run(p, scids):
+    with cursor(p) as db:
+        for scid in scids:
+            run_for_channel(db, scid)
 
 
 def run_for_channel(db, scid):
-    db.execute(
+    execute(
+        db,
+        "chain_analysis_updates",
         """
 WITH matching AS (
   SELECT x.short_channel_id AS x_scid, x.nodes AS x_nodes,
@@ -133,7 +138,9 @@ INNER JOIN channels ON channels.short_channel_id = updates.scid
                 params.append((({"a", "b"} - {label}).pop(), 1 - value))
 
         for label, value in params:
-            db.execute(
+            execute(
+                db,
+                f"update_channel_{label}",
                 f"UPDATE channels SET {label} = %s WHERE short_channel_id = %s",
                 (value, scid),
             )
@@ -0,0 +1,94 @@
+import re
+import uuid
+import psycopg2
+import psycopg2.extensions
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
+
+from .globals import POSTGRES_URL, POSTGRES_ITERSIZE
+
+
+class Connection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # names of the statements already prepared in this session
+        self.prepared = set()
+
+
+@contextmanager
+def pool(size: int):
+    # shared by all stages of a run, sized for the stage that uses the most
+    # connections at once (usually one for writing and one for streaming reads)
+    # minconn is the same as maxconn because the pool closes any connection
+    # given back beyond minconn, and with it the statements prepared on it
+    p = ThreadedConnectionPool(
+        size, size, POSTGRES_URL, connection_factory=Connection
+    )
+    try:
+        yield p
+    finally:
+        p.closeall()
+
+
+@contextmanager
+def cursor(p: ThreadedConnectionPool):
+    conn = p.getconn()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as db:
+            yield db
+    finally:
+        p.putconn(conn)
+
+
+def stream(p: ThreadedConnectionPool, query: str, params=None):
+    # named (server-side) cursors only live inside a transaction, so these
+    # take their own connection instead of the autocommit one used for writes
+    conn = p.getconn()
+    conn.autocommit = False
+    try:
+        with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as c:
+            c.itersize = POSTGRES_ITERSIZE
+            c.execute(query, params)
+            yield from c
+    finally:
+        conn.rollback()
+        p.putconn(conn)
+
+
+def execute(db, name: str, query: str, params=()):
+    # prepares the query the first time it is seen on this connection
+    # then just executes it with the given params
+    conn = db.connection
+    if name not in conn.prepared:
+        # PREPARE is sent without params, so %% must become a literal % here.
+        # this doesn't parse SQL, so queries can't have "%s" inside string literals
+        placeholders = re.findall(r"%%|%s", query).count("%s")
+        assert placeholders == len(params), f"{name}: {placeholders} placeholders"
+
+        counter = iter(range(1, len(params) + 1))
+        positional = re.sub(
+            r"%%|%s",
+            lambda m: "%" if m.group() == "%%" else f"${next(counter)}",
+            query,
+        )
+        db.execute(f"PREPARE {name} AS {positional}")
+        conn.prepared.add(name)
+
+    if params:
+        db.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        db.execute(f"EXECUTE {name}")
+
+
+def refresh_views(
+    p: ThreadedConnectionPool,
+    views=("last_block", "nodes", "globalstats", "closetypes"),
+):
+    # globalstats reads from last_block and nodes, so those go first.
+    # these are refreshed concurrently (they all have a unique index) so
+    # readers aren't blocked while they are rebuilt
+    with cursor(p) as db:
+        for view in views:
+            db.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}")
@@ -0,0 +1,152 @@
+import time
+import psycopg2
+from typing import Dict, Optional, Tuple
+
+from .db import pool, cursor, refresh_views
+from .globals import bitcoin
+from .inspectblocks import load_funding_outpoints, inspectblock
+from .onchain import onclose
+from .utils import get_outspends
+from .listchannels import listchannels
+from .listnodes import listnodes
+from .unknownclosetypes import unknownclosetypes
+from .chain_analysis import chain_analysis, THREADS
+
+
+def follow(
+    poll_seconds: int = 30,
+    gossip_seconds: int = 600,
+    analysis_seconds: int = 86400,
+):
+    # shares the "last_block" progress file with inspectblocks, so it's possible
+    # to switch between this and the batch mode without missing blocks
+    try:
+        with open("last_block") as f:
+            blockheight = int(f.read())
+    except:
+        blockheight = bitcoin.getblockcount()
+
+    besthash = None
+    hashes: Dict[int, str] = {}  # recently inspected blocks, to detect reorgs
+    outpoints: Optional[Dict[Tuple[str, int], str]] = None
+    next_gossip = 0.0
+    next_analysis = time.time() + analysis_seconds
+
+    while True:
+        try:
+            # a new pool (and new connections) every time postgres fails on us
+            with pool(THREADS) as p:
+                outpoints = loadnewchannels(p, outpoints)
+
+                while True:
+                    try:
+                        tip = bitcoin.getbestblockhash()
+                        if tip != besthash:
+                            blockheight = rewind_reorged(p, blockheight, hashes)
+                            blockheight = inspectnewblocks(
+                                p, blockheight, tip, outpoints, hashes
+                            )
+                            refresh_views(p, ("last_block", "closetypes"))
+                            besthash = tip
+
+                        if time.time() >= next_gossip:
+                            print("listing channels")
+                            listchannels(p)
+                            print("inserting nodes")
+                            listnodes(p)
+
+                            outpoints = loadnewchannels(p, outpoints)
+                            refresh_views(p, ("nodes", "globalstats"))
+                            next_gossip = time.time() + gossip_seconds
+
+                        if time.time() >= next_analysis:
+                            print("rechecking unknown close types")
+                            unknownclosetypes(p)
+                            print("performing chain analysis")
+                            chain_analysis(p)
+                            next_analysis = time.time() + analysis_seconds
+                    except psycopg2.Error:
+                        raise
+                    except Exception as exc:
+                        # bitcoind, sparko or the esploras are down, try again later
+                        print(exc)
+
+                    time.sleep(poll_seconds)
+        except psycopg2.Error as exc:
+            print(exc)
+            time.sleep(poll_seconds)
+
+
+def loadnewchannels(p, known):
+    outpoints = load_funding_outpoints(p)
+    if known is None:
+        return outpoints
+
+    # channels we've just learned about may have closed already, in blocks we
+    # inspected before knowing about them, so we look for their closes directly
+    with cursor(p) as db:
+        for (txid, n), scid in outpoints.items():
+            if (txid, n) in known or bitcoin.gettxout(txid, n) is not None:
+                continue
+
+            spend = get_outspends(txid)[n]
+            if not spend["spent"] or not spend["status"]["confirmed"]:
+                continue
+
+            print(f"{scid} was closed before we knew about it")
+            tx = bitcoin.getrawtransaction(spend["txid"], True)
+            onclose(
+                db,
+                spend["status"]["block_height"],
+                spend["status"]["block_time"],
+                tx,
+                tx["vin"][spend["vin"]],
+                scid,
+            )
+
+    return outpoints
+
+
+def rewind_reorged(p, blockheight: int, hashes: Dict[int, str]) -> int:
+    # go back to the last block we inspected that is still in the main chain
+    rewound = blockheight
+    while (
+        rewound - 1 in hashes
+        and bitcoin.getblockhash(rewound - 1) != hashes[rewound - 1]
+    ):
+        rewound -= 1
+        del hashes[rewound]
+        print(f"block {rewound} was reorged out")
+
+    if rewound < blockheight:
+        # forget closes from the blocks that are gone, if their transactions
+        # are mined again we'll see them when inspecting the new blocks
+        with cursor(p) as db:
+            db.execute(
+                """
+UPDATE channels
+SET close = DEFAULT
+  , closer = NULL
+  , txs = txs || '{"a": [], "b": []}'
+WHERE (close->>'block')::int >= %s
+                """,
+                (rewound,),
+            )
+
+    return rewound
+
+
+def inspectnewblocks(p, blockheight: int, tip: str, outpoints, hashes) -> int:
+    tipheight = bitcoin.getblockheader(tip)["height"]
+
+    with cursor(p) as db:
+        while blockheight <= tipheight:
+            print(f"inspecting block {blockheight}")
+            hashes[blockheight] = inspectblock(db, blockheight, outpoints)
+            hashes.pop(blockheight - 100, None)
+
+            blockheight += 1
+            with open("last_block", "w") as f:
+                f.write(str(blockheight))
+
+    return blockheight
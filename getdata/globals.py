@@ -2,6 +2,7 @@ import os
 from bitcoin_requests import BitcoinRPC
 
 POSTGRES_URL = os.getenv("POSTGRES_URL")
+POSTGRES_ITERSIZE = int(os.getenv("POSTGRES_ITERSIZE") or 2000)
 BITCOIN_RPC_ADDRESS = os.getenv("BITCOIN_RPC_ADDRESS") or "http://127.0.0.1:8443"
 BITCOIN_RPC_USER = os.getenv("BITCOIN_RPC_USER")
 BITCOIN_RPC_PASSWORD = os.getenv("BITCOIN_RPC_PASSWORD")
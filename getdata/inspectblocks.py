@@ -1,12 +1,13 @@
-from typing import Dict
+from typing import Dict, Tuple
 from tqdm import tqdm
 from bitcoin_requests.bitcoin import JSONRPCError
 
+from .db import cursor, stream
 from .globals import bitcoin, last_block
 from .onchain import onclose
 
 
-def inspectblocks(db):
+def inspectblocks(p):
     try:
         with open("last_block") as f:
             blockheight = int(f.read())
@@ -21,22 +22,16 @@ def inspectblocks(db):
         # we might had not seen in the last scans
         blockheight = end_at_block - 14 * 144
 
-    db.execute("""SELECT short_channel_id, open->>'txid' FROM channels""")
-    open_txid_map: Dict[str, str] = {txid: scid for scid, txid in db.fetchall()}
+    outpoints = load_funding_outpoints(p)
 
     # go block by block
-    with tqdm(total=end_at_block - blockheight) as pbar:
+    with cursor(p) as db, tqdm(total=end_at_block - blockheight) as pbar:
         while blockheight < end_at_block:
             pbar.update()
             pbar.set_description(f"block {blockheight}")
 
             try:
-                block = bitcoin.getblock(bitcoin.getblockhash(blockheight), 2)
-                for tx in block["tx"][1:]:  # skip coinbase
-                    for vin in tx["vin"]:
-                        scid = open_txid_map.get(vin["txid"])
-                        if scid and vin["vout"] == int(scid.split("x")[2]):
-                            onclose(db, blockheight, block["time"], tx, vin, scid)
+                inspectblock(db, blockheight, outpoints)
             except JSONRPCError as exc:
                 print(exc)
                 return
@@ -44,3 +39,29 @@ def inspectblocks(db):
             blockheight += 1
             with open("last_block", "w") as f:
                 f.write(str(blockheight))
+
+
+def load_funding_outpoints(p) -> Dict[Tuple[str, int], str]:
+    # (funding txid, output index) -> short_channel_id for every known channel
+    return {
+        (txid, int(scid.split("x")[2])): scid
+        for scid, txid in stream(
+            p,
+            """
+SELECT short_channel_id, open->>'txid'
+FROM channels
+WHERE open->>'txid' IS NOT NULL
+            """,
+        )
+    }
+
+
+def inspectblock(db, blockheight: int, outpoints: Dict[Tuple[str, int], str]) -> str:
+    block = bitcoin.getblock(bitcoin.getblockhash(blockheight), 2)
+    for tx in block["tx"][1:]:  # skip coinbase
+        for vin in tx["vin"]:
+            scid = outpoints.get((vin["txid"], vin["vout"]))
+            if scid:
+                onclose(db, blockheight, block["time"], tx, vin, scid)
+
+    return block["hash"]
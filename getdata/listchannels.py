@@ -3,68 +3,89 @@ import requests
 from tqdm import tqdm
 from typing import Dict
 
+from .db import cursor, stream, execute
 from .globals import SPARK_URL, SPARK_TOKEN, bitcoin
 from .onchain import onopen
 
 
-def listchannels(db):
+def listchannels(p):
     now = int(datetime.datetime.now().timestamp())
 
     r = requests.post(
         SPARK_URL, headers={"X-Access": SPARK_TOKEN}, json={"method": "listchannels"}
     )
 
-    db.execute("SELECT short_channel_id, last_update, open FROM channels")
-    rows = db.fetchall()
-    channel_last_update_by_scid: Dict[str, int] = {
-        scid: int(last_update.timestamp()) for scid, last_update, _ in rows
-    }
-
-    for scid, _, ch_open in tqdm(rows, leave=True, desc="filling blanks"):
-        if (
-            not ch_open["block"]
-            or not ch_open["fee"]
-            or not ch_open["txid"]
-            or not ch_open["time"]
-        ):
-            # channel with insufficient onchain data
+    with cursor(p) as db:
+        channel_last_update_by_scid: Dict[str, int] = {
+            scid: int(last_update.timestamp())
+            for scid, last_update in stream(
+                p, "SELECT short_channel_id, last_update FROM channels"
+            )
+        }
+
+        # channels with insufficient onchain data
+        blanks = stream(
+            p,
+            """
+SELECT short_channel_id
+FROM channels
+WHERE open->>'block' IS NULL
+   OR open->>'fee' IS NULL
+   OR open->>'txid' IS NULL
+   OR open->>'time' IS NULL
+            """,
+        )
+        for (scid,) in tqdm(blanks, leave=True, desc="filling blanks"):
             blockheight, tx_index, out_n = map(int, scid.split("x"))
             block = bitcoin.getblock(bitcoin.getblockhash(blockheight))
             tx = bitcoin.getrawtransaction(block["tx"][tx_index], True)
             onopen(db, blockheight, block["time"], tx, tx["vout"][out_n], scid, None)
 
-    pbar = tqdm(r.json()["channels"], leave=True, desc="listchannels")
-    for ch in pbar:
-        pbar.set_description("list " + ch["short_channel_id"])
-
-        if ch["public"] == False:
-            continue
-
-        last_update = channel_last_update_by_scid.get(ch["short_channel_id"], 0)
-
-        if not last_update:
-            # channel not known, gather onchain data
-            blockheight, tx_index, out_n = map(int, ch["short_channel_id"].split("x"))
-
-            # gather onchain data
-            block = bitcoin.getblock(bitcoin.getblockhash(blockheight))
-            tx = bitcoin.getrawtransaction(block["tx"][tx_index], True)
-            onopen(
-                db,
-                blockheight,
-                block["time"],
-                tx,
-                tx["vout"][out_n],
-                ch["short_channel_id"],
-                ch,
-            )
-
-        if last_update < ch["last_update"]:
-            # update policies
-            save_fee_policies(db, ch)
-    pbar.close()
-
-    db.execute("""UPDATE channels SET last_update = to_timestamp(%s)""", (now,))
+        updated = set()
+        pbar = tqdm(r.json()["channels"], leave=True, desc="listchannels")
+        for ch in pbar:
+            pbar.set_description("list " + ch["short_channel_id"])
+
+            if ch["public"] == False:
+                continue
+
+            last_update = channel_last_update_by_scid.get(ch["short_channel_id"], 0)
+
+            if not last_update:
+                # channel not known, gather onchain data
+                blockheight, tx_index, out_n = map(
+                    int, ch["short_channel_id"].split("x")
+                )
+
+                # gather onchain data
+                block = bitcoin.getblock(bitcoin.getblockhash(blockheight))
+                tx = bitcoin.getrawtransaction(block["tx"][tx_index], True)
+                onopen(
+                    db,
+                    blockheight,
+                    block["time"],
+                    tx,
+                    tx["vout"][out_n],
+                    ch["short_channel_id"],
+                    ch,
+                )
+
+            if last_update < ch["last_update"]:
+                # update policies
+                save_fee_policies(db, ch)
+                updated.add(ch["short_channel_id"])
+        pbar.close()
+
+        # only touch the channels that had new updates, the others are still
+        # up to date as of the last time we saw them
+        db.execute(
+            """
+UPDATE channels
+SET last_update = to_timestamp(%s)
+WHERE short_channel_id = ANY(%s)
+            """,
+            (now, list(updated)),
+        )
 
 
 def save_fee_policies(db, ch):
@@ -74,7 +95,9 @@ def save_fee_policies(db, ch):
         else (ch["destination"], ch["source"], 0)
     )
 
-    db.execute(
+    execute(
+        db,
+        "select_fee_policy_uptodate",
         """
 SELECT
   CASE WHEN base_fee_millisatoshi = %s AND fee_per_millionth = %s AND delay = %s
@@ -98,7 +121,9 @@ LIMIT 1
     isfeepolicyuptodate = row[0] if row else False
 
     if not isfeepolicyuptodate:
-        db.execute(
+        execute(
+            db,
+            "insert_policy",
             """
 INSERT INTO policies
     (short_channel_id, direction,
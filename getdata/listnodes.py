@@ -1,55 +1,79 @@
 import requests
 from tqdm import tqdm
 
+from .db import cursor, stream, execute
 from .globals import SPARK_URL, SPARK_TOKEN
 
 
-def listnodes(db):
+def listnodes(p):
     r = requests.post(
         SPARK_URL, headers={"X-Access": SPARK_TOKEN}, json={"method": "listnodes"}
     )
     nodes = r.json()["nodes"]
 
-    db.execute(
-        """
+    nodealiases = {
+        pubkey: alias
+        for pubkey, alias in stream(
+            p,
+            """
 SELECT DISTINCT ON (pubkey) pubkey, alias
 FROM nodealiases
 ORDER BY pubkey, first_seen DESC
-        """
-    )
-    nodealiases = {pubkey: alias for pubkey, alias in db.fetchall()}
-    db.execute(
-        """
+            """,
+        )
+    }
+    nodefeatures = {
+        pubkey: features
+        for pubkey, features in stream(
+            p,
+            """
 SELECT DISTINCT ON (pubkey) pubkey, features
 FROM features
 ORDER BY pubkey, first_seen DESC
-        """
-    )
-    nodefeatures = {pubkey: features for pubkey, features in db.fetchall()}
+            """,
+        )
+    }
+
+    with cursor(p) as db:
+        for node in tqdm(nodes, leave=True, desc="listnodes"):
+            save_node(db, node, nodealiases, nodefeatures)
 
-    for node in tqdm(nodes, leave=True, desc="listnodes"):
-        pubkey = node["nodeid"]
 
-        # alias, color
-        alias = node.get("alias")
-        if alias and nodealiases.get(pubkey) != alias:
-            db.execute(
-                """
+def save_node(db, node, nodealiases, nodefeatures):
+    pubkey = node["nodeid"]
+
+    # alias, color
+    alias = node.get("alias")
+    if alias and nodealiases.get(pubkey) != alias:
+        execute(
+            db,
+            "insert_alias",
+            """
 INSERT INTO nodealiases
   (pubkey, color, alias, first_seen)
 VALUES (%s, %s, %s, now())
-            """,
-                (pubkey, node.get("color", ""), alias),
-            )
-
-        # features bitstring
-        features = node.get("features")
-        if features and nodefeatures.get(pubkey) != features:
-            db.execute(
-                """
+        """,
+            (pubkey, node.get("color", ""), alias),
+        )
+
+    # features bitstring, stored along with its decoded bitsets
+    # and classified into implementations right away
+    features = node.get("features")
+    if features and nodefeatures.get(pubkey) != features:
+        execute(
+            db,
+            "insert_features",
+            """
 INSERT INTO features
-  (pubkey, features, first_seen)
-VALUES (%s, %s, now())
-            """,
-                (pubkey, features),
-            )
+  (pubkey, features, required, optional, candidates, first_seen)
+SELECT pubkey, features, required, optional,
+  classify_features(required, optional), now()
+FROM (
+  SELECT pubkey, features,
+    feature_bits(features, 0) AS required,
+    feature_bits(features, 1) AS optional
+  FROM (SELECT %s::text AS pubkey, %s::text AS features) AS node
+) AS decoded
+        """,
+            (pubkey, features),
+        )
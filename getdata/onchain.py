@@ -1,8 +1,9 @@
 import json
 from typing import Dict
 
+from .db import execute
 from .utils import get_fee, get_outspends
-from .globals import bitcoin, last_block
+from .globals import bitcoin
 
 
 def onopen(
@@ -32,7 +33,9 @@ def onopen(
             else (ch["destination"], ch["source"], 0)
         )
 
-        db.execute(
+        execute(
+            db,
+            "insert_channel",
             """
 INSERT INTO channels (short_channel_id, nodes, satoshis, last_update)
 VALUES (%s, %s, %s, to_timestamp(%s))
@@ -46,7 +49,9 @@ ON CONFLICT (short_channel_id) DO NOTHING
             ),
         )
 
-    db.execute(
+    execute(
+        db,
+        "update_channel_open",
         """
 UPDATE channels
 SET open = %s
@@ -58,6 +63,8 @@ WHERE short_channel_id = %s
 
 
 def onclose(db, blockheight, blocktime, tx, vin, scid):
+    # not the one from globals, as that gets old in long running processes
+    tipheight = bitcoin.getblockcount()
     txs = {"a": set(), "b": set()}
     spends = get_outspends(tx["txid"])
     kinds = set()
@@ -78,7 +85,7 @@ def onclose(db, blockheight, blocktime, tx, vin, scid):
             # we can't know what this is, maybe it's a mutual closure and the
             # funds are waiting at someone's wallet, or it's a delayed output
             # that wasn't spent yet because the time hasn't arrived
-            if blockheight + 3000 > last_block:
+            if blockheight + 3000 > tipheight:
                 kinds.add("unknown")
             else:
                 kinds.add("any")
@@ -215,7 +222,9 @@ def onclose(db, blockheight, blocktime, tx, vin, scid):
                 {"amount": htlc["amount"], "offerer": offerer, "fulfilled": fulfilled}
             )
 
-    db.execute(
+    execute(
+        db,
+        "update_channel_close",
         """
 UPDATE channels
 SET close = %s
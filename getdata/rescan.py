@@ -0,0 +1,143 @@
+import os
+import time
+import socket
+import psycopg2
+from multiprocessing import Process
+
+from .db import pool, cursor
+from .globals import last_block
+from .inspectblocks import load_funding_outpoints, inspectblock
+
+
+def rescan(
+    workers: int = 4,
+    start: int = 506425,
+    lease_size: int = 1000,
+    stall_seconds: int = 600,
+    reset: bool = False,
+):
+    # the height range is split into leases stored in the database so
+    # any number of processes (on this or other machines) can share the work.
+    # closes are written with onclose, which just overwrites the channel data,
+    # so scanning the same block twice (e.g. after a lease is retaken) is harmless
+    with pool(1) as p, cursor(p) as db:
+        if reset:
+            db.execute("DELETE FROM blockleases")
+
+        # leases from a previous rescan must be on the same grid, otherwise
+        # the new ones would overlap them
+        db.execute(
+            """
+SELECT count(*)
+FROM blockleases
+WHERE start_block < %s
+   OR (start_block - %s) %% %s != 0
+   OR end_block - start_block > %s
+            """,
+            (start, start, lease_size, lease_size),
+        )
+        if db.fetchone()[0]:
+            raise Exception(
+                "existing leases were created with a different --from or "
+                "--lease-size, use the same values or pass --reset"
+            )
+
+        # the last lease of a previous rescan is extended up to the current tip
+        db.execute(
+            """
+INSERT INTO blockleases (start_block, end_block, next_block)
+SELECT s, least(s + %s, %s), s
+FROM generate_series(%s, %s - 1, %s) AS s
+ON CONFLICT (start_block) DO UPDATE
+SET end_block = greatest(blockleases.end_block, EXCLUDED.end_block)
+            """,
+            (lease_size, last_block, start, last_block, lease_size),
+        )
+
+    processes = [
+        Process(target=rescan_worker, args=(stall_seconds,)) for _ in range(workers)
+    ]
+    for proc in processes:
+        proc.start()
+
+    for proc in processes:
+        proc.join()
+
+
+def rescan_worker(stall_seconds: int):
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+
+    with pool(1) as p:
+        outpoints = load_funding_outpoints(p)
+
+        with cursor(p) as db:
+            while True:
+                lease = claim_lease(db, worker, stall_seconds)
+                if not lease:
+                    return
+
+                start_block, end_block, blockheight = lease
+                print(f"{worker} scanning blocks {blockheight}-{end_block}")
+
+                try:
+                    while blockheight < end_block:
+                        inspectblock(db, blockheight, outpoints)
+                        blockheight += 1
+
+                        if not heartbeat(db, worker, start_block, blockheight):
+                            # someone else took this lease from us
+                            print(f"{worker} lost lease {start_block}")
+                            break
+                except psycopg2.Error:
+                    raise
+                except Exception as exc:
+                    # bitcoind or the esploras failed, maybe they're rate-limiting us,
+                    # so let someone else try it while we wait a little
+                    print(exc)
+                    release_lease(db, worker, start_block)
+                    time.sleep(30)
+
+
+def claim_lease(db, worker: str, stall_seconds: int):
+    # takes either a lease nobody has or one whose worker stopped heartbeating
+    db.execute(
+        """
+UPDATE blockleases
+SET worker = %s, heartbeat = now()
+WHERE start_block = (
+  SELECT start_block
+  FROM blockleases
+  WHERE next_block < end_block
+    AND (worker IS NULL OR heartbeat < now() - make_interval(secs => %s))
+  ORDER BY start_block
+  LIMIT 1
+  FOR UPDATE SKIP LOCKED
+)
+RETURNING start_block, end_block, next_block
+        """,
+        (worker, stall_seconds),
+    )
+    return db.fetchone()
+
+
+def heartbeat(db, worker: str, start_block: int, next_block: int) -> bool:
+    db.execute(
+        """
+UPDATE blockleases
+SET heartbeat = now(), next_block = %s
+WHERE start_block = %s AND worker = %s
+        """,
+        (next_block, start_block, worker),
+    )
+    return db.rowcount == 1
+
+
+def release_lease(db, worker: str, start_block: int):
+    db.execute(
+        """
+UPDATE blockleases
+SET worker = NULL, heartbeat = NULL
+WHERE start_block = %s AND worker = %s
+        """,
+        (start_block, worker),
+    )
@@ -1,22 +1,33 @@
 from tqdm import tqdm
 
+from .db import cursor, stream
 from .globals import bitcoin
 from .onchain import onclose
 
 
-def unknownclosetypes(db):
-    db.execute(
+def unknownclosetypes(p):
+    with cursor(p) as db:
+        db.execute(
+            """
+        SELECT count(*)
+        FROM channels
+        WHERE close->>'block' IS NOT NULL
+          AND close->>'type' = 'unknown'
+        """
+        )
+        (total,) = db.fetchone()
+
+    rows = stream(
+        p,
         """
         SELECT short_channel_id, close->>'txid', (close->>'block')::int, close->>'time'
         FROM channels
         WHERE close->>'block' IS NOT NULL
           AND close->>'type' = 'unknown'
-    """
+    """,
     )
 
-    rows = db.fetchall()
-
-    with tqdm(total=len(rows)) as pbar:
+    with cursor(p) as db, tqdm(total=total) as pbar:
         for scid, txid, blockheight, time in rows:
             pbar.update()
             pbar.set_description(f"unknown close type {scid}")
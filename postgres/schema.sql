@@ -104,10 +104,173 @@ GRANT SELECT ON nodealiases TO web_anon;
 CREATE TABLE IF NOT EXISTS features (
   pubkey text NOT NULL,
   features text NOT NULL,
+
+  -- decoded feature bits: bit n is set when feature n is required (even bit 2n)
+  -- or optional (odd bit 2n+1) in the features bitstring
+  required bigint,
+  optional bigint,
+
+  -- implementations this row was classified as, see classify_features
+  candidates text[],
+
   first_seen timestamp NOT NULL
 );
+ALTER TABLE features ADD COLUMN IF NOT EXISTS required bigint;
+ALTER TABLE features ADD COLUMN IF NOT EXISTS optional bigint;
+ALTER TABLE features ADD COLUMN IF NOT EXISTS candidates text[];
+CREATE INDEX IF NOT EXISTS index_features_pubkey ON features(pubkey, first_seen DESC);
 GRANT SELECT ON features TO web_anon;
 
+CREATE OR REPLACE FUNCTION popcount (x bigint) RETURNS int AS $$
+  SELECT length(replace(x::bit(64)::text, '0', ''))
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- decode a hex features bitstring into a bitset of required (parity 0) or
+-- optional (parity 1) features, bit n being feature n
+CREATE OR REPLACE FUNCTION feature_bits (features text, parity int) RETURNS bigint AS $$
+  SELECT coalesce(bit_or(1::bigint << (n / 2)), 0)
+  FROM generate_series(0, least(length(features) * 4, 126) - 1) AS n
+  WHERE n % 2 = parity
+    AND get_bit(('x' || features)::varbit, length(features) * 4 - 1 - n) = 1
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- one row per known feature bitstring, decoded into required/optional bitsets
+-- so nodes can be scored against them instead of matched by exact string
+CREATE TABLE IF NOT EXISTS featuresignatures (
+  name text NOT NULL,
+  version text NOT NULL,
+  featurebits text NOT NULL,
+  required bigint NOT NULL,
+  optional bigint NOT NULL,
+  PRIMARY KEY (name, version, featurebits)
+);
+
+INSERT INTO featuresignatures (name, version, featurebits, required, optional)
+  SELECT name, version, featurebits,
+    feature_bits(featurebits, 0),
+    feature_bits(featurebits, 1)
+  FROM (VALUES
+    ('c-lightning', '0.6', '88'),
+    ('c-lightning', '0.6.1', '8a'),
+    ('c-lightning', '0.6.2', '8a'),
+    ('c-lightning', '0.6.3', '88'),
+    ('c-lightning', '0.7.0', '8a'),
+    ('c-lightning', '0.7.1', 'aa'),
+    ('c-lightning', '0.7.2.1', 'aa'),
+    ('c-lightning', '0.7.3', '28a2'),
+    ('c-lightning', '0.8.0', '02aaa2'),
+    ('c-lightning', '0.8.1', '02aaa2'),
+    ('c-lightning', '0.8.2-keysend', '8000000002aaa2'),
+    ('c-lightning', '0.9.0', '02aaa2'),
+    ('c-lightning', '0.9.0-wumbo', '0aaaa2'),
+    ('c-lightning', '0.9.2', '02aaa2'),
+    ('eclair', '0.3.1', '8a'),
+    ('eclair', '0.3.2', '0a8a'),
+    ('eclair', '0.3.3', '0a8a'),
+    ('eclair', '0.3.3-mpp', '028a8a'),
+    ('eclair', 'acinq_node', '0a8a8a'),
+    ('eclair', 'guess', '0200'),
+    ('eclair', '0.3.4', '0a8a'),
+    ('eclair', '0.3.4-wumbo', '080a8a'),
+    ('eclair', '0.3.4-mpp', '028a8a'),
+    ('eclair', '0.4', '0a8a'),
+    ('eclair', '0.4-wumbo', '080a8a'),
+    ('eclair', '0.4-mpp', '028a8a'),
+    ('eclair', '0.4-mpp-wumbo', '0a8a8a'),
+    ('eclair', '0.4.1', '0a8a'),
+    ('eclair', '0.4.1-srk', '2a8a'),
+    ('eclair', '0.4.1-trmp', '080a8a'),
+    ('eclair', '0.4.1-srk-trmp-kys', '08000000082a8a'),
+    ('eclair', '0.4.2', '080a8a'),
+    ('eclair', '0.5.0', '0aaa8a'),
+    ('eclair', '0.5.0-srk-sec', '0a5a8a'),
+    ('eclair', '0.5.0-srk', '0a9a8a'),
+    ('eclair', '0.5.0-sec', '0a6a8a'),
+    ('eclair', '0.5.0-kys', '800000000aaa8a'),
+    ('eclair', '0.5.0-srk-kys', '800000000a9a8a'),
+    ('eclair', '0.5.0-trmp1', '8800000022aa8a'),
+    ('eclair', '0.5.0-trmp2', '880000002aaa8a'),
+    ('eclair', '0.5.0-trmp3', '8800000028aa8a'),
+    ('eclair', '0.5.0-trmp4', '880000002a9a8a'),
+    ('eclair', '0.5.0-trmp5', '880000002a5a8a'),
+    ('eclair', '0.5.0-trmp6', '800000002a5a89'),
+    ('eclair', '0.5.0-trmp6', '800000002aaa89'),
+    ('lnd', '0.4.1', '08'),
+    ('lnd', '0.4.2', '08'),
+    ('lnd', '0.5', '82'),
+    ('lnd', '0.5.2', '82'),
+    ('lnd', '0.6', '81'),
+    ('lnd', '0.6.1', '81'),
+    ('lnd', '0.7.1', '81'),
+    ('lnd', '0.8.0', '2281'),
+    ('lnd', '0.8.1', '2281'),
+    ('lnd', '0.8.2', '2281'),
+    ('lnd', '0.9.0', '02a2a1'),
+    ('lnd', '0.9.1', '02a2a1'),
+    ('lnd', '0.9.2', '02a2a1'),
+    ('lnd', '0.10.0', '02a2a1'),
+    ('lnd', 'probably', '0a00'),
+    ('lnd', 'guess', '2200'),
+    ('lnd', '0.11', '02a2a1'),
+    ('lnd', '0.11-wumbo', '0aa2a1'),
+    ('lnd', '0.12', '8252a1'),
+    ('lnd', '0.12-wumbo', '8a52a1'),
+    ('lnd', '0.12-noanchors', '0252a1'),
+    ('lnd', '0.12-noanchors-wumbo', '0a52a1'),
+    ('electrum', '4.0.4', 'b203')
+  ) AS daemon (name, version, featurebits)
+ON CONFLICT DO NOTHING;
+
+-- every implementation whose signature scores best against the given bitsets:
+-- matching required bits count double, matching features count once and
+-- every feature present on only one side (or required on only one side) costs one
+CREATE OR REPLACE FUNCTION classify_features (req bigint, opt bigint) RETURNS text[] AS $$
+  WITH scored AS (
+    SELECT name,
+        2 * popcount(req & required)
+      + popcount((req | opt) & (required | optional))
+      - popcount((req | opt) # (required | optional))
+      - popcount(req # required) AS score
+    FROM featuresignatures
+  )
+  SELECT coalesce(array_agg(DISTINCT name), '{}')
+  FROM scored
+  WHERE score > 0 AND score = (SELECT max(score) FROM scored)
+$$ LANGUAGE SQL STABLE;
+
+-- backfill rows inserted before the bitset columns existed
+UPDATE features
+SET required = feature_bits(features, 0)
+  , optional = feature_bits(features, 1)
+WHERE required IS NULL;
+
+-- reclassify every row so additions or fixes to featuresignatures also apply
+-- to features seen before them (listnodes only classifies new rows)
+UPDATE features
+SET candidates = classify_features(required, optional)
+WHERE candidates IS DISTINCT FROM classify_features(required, optional);
+
+-- implementations are classified once per features row on insert (see listnodes),
+-- so this only needs to tally votes and is cheap enough to not be materialized.
+-- (on an existing database: DROP MATERIALIZED VIEW implementations CASCADE first,
+-- see the README)
+CREATE OR REPLACE VIEW implementations AS
+  WITH counts AS (
+    SELECT pubkey,
+      count(*) FILTER (WHERE 'eclair' = ANY(candidates)) AS eclair,
+      count(*) FILTER (WHERE 'lnd' = ANY(candidates)) AS lnd,
+      count(*) FILTER (WHERE 'c-lightning' = ANY(candidates)) AS clightning
+    FROM features
+    GROUP BY pubkey
+  )
+  SELECT pubkey, CASE
+    WHEN eclair > clightning AND eclair > lnd THEN 'eclair'
+    WHEN clightning > lnd THEN 'c-lightning'
+    WHEN lnd > 0 THEN 'lnd'
+  END AS implementation
+  FROM counts;
+GRANT SELECT ON implementations TO web_anon;
+
 CREATE TABLE IF NOT EXISTS policies (
   short_channel_id text NOT NULL,
   direction integer NOT NULL, -- 1 means from node0 to node1 and vice-versa
@@ -118,6 +281,15 @@ CREATE TABLE IF NOT EXISTS policies (
 );
 GRANT SELECT ON policies TO web_anon;
 
+-- block height ranges handed out to `getdata rescan` workers
+CREATE TABLE IF NOT EXISTS blockleases (
+  start_block integer PRIMARY KEY,
+  end_block integer NOT NULL, -- exclusive
+  next_block integer NOT NULL, -- first block not yet scanned
+  worker text,
+  heartbeat timestamptz -- compared across sessions that may be in other timezones
+);
+
 CREATE MATERIALIZED VIEW nodes AS
   WITH pubkeys AS (
     SELECT DISTINCT pubkey FROM (
@@ -177,7 +349,7 @@ CREATE MATERIALIZED VIEW nodes AS
   FROM agg
   LEFT JOIN nodealias ON agg.pubkey = nodealias.pubkey
   LEFT JOIN open ON agg.pubkey = open.pubkey;
-CREATE INDEX IF NOT EXISTS index_node ON nodes(pubkey);
+CREATE UNIQUE INDEX IF NOT EXISTS index_node ON nodes(pubkey);
 GRANT SELECT ON nodes TO web_anon;
 
 CREATE MATERIALIZED VIEW last_block AS
@@ -187,6 +359,7 @@ CREATE MATERIALIZED VIEW last_block AS
     UNION ALL
       SELECT max((close->>'block')::int) AS b FROM channels
   )x;
+CREATE UNIQUE INDEX IF NOT EXISTS index_last_block ON last_block(last_block);
 GRANT SELECT on last_block TO web_anon;
 
 CREATE MATERIALIZED VIEW globalstats AS
@@ -227,6 +400,7 @@ CREATE MATERIALIZED VIEW globalstats AS
     nodes.max_average_open_fee  AS max_node_average_open_fee,
     nodes.max_average_close_fee AS max_node_average_close_fee
   FROM channels, nodes;
+CREATE UNIQUE INDEX IF NOT EXISTS index_globalstats ON globalstats(last_block);
 GRANT SELECT ON globalstats TO web_anon;
 
 CREATE MATERIALIZED VIEW closetypes AS
@@ -255,99 +429,9 @@ CREATE MATERIALIZED VIEW closetypes AS
   WHERE blockgroup IS NOT NULL
   GROUP BY blockgroup
   ORDER BY blockgroup;
+CREATE UNIQUE INDEX IF NOT EXISTS index_closetypes ON closetypes(blockgroup);
 GRANT SELECT ON closetypes TO web_anon;
 
-CREATE MATERIALIZED VIEW implementations AS
-  WITH daemon (name, version, featurebits) AS (
-    VALUES
-      ('c-lightning', '0.6', '88'),
-      ('c-lightning', '0.6.1', '8a'),
-      ('c-lightning', '0.6.2', '8a'),
-      ('c-lightning', '0.6.3', '88'),
-      ('c-lightning', '0.7.0', '8a'),
-      ('c-lightning', '0.7.1', 'aa'),
-      ('c-lightning', '0.7.2.1', 'aa'),
-      ('c-lightning', '0.7.3', '28a2'),
-      ('c-lightning', '0.8.0', '02aaa2'),
-      ('c-lightning', '0.8.1', '02aaa2'),
-      ('c-lightning', '0.8.2-keysend', '8000000002aaa2'),
-      ('c-lightning', '0.9.0', '02aaa2'),
-      ('c-lightning', '0.9.0-wumbo', '0aaaa2'),
-      ('c-lightning', '0.9.2', '02aaa2'),
-      ('eclair', '0.3.1', '8a'),
-      ('eclair', '0.3.2', '0a8a'),
-      ('eclair', '0.3.3', '0a8a'),
-      ('eclair', '0.3.3-mpp', '028a8a'),
-      ('eclair', 'acinq_node', '0a8a8a'),
-      ('eclair', 'guess', '0200'),
-      ('eclair', '0.3.4', '0a8a'),
-      ('eclair', '0.3.4-wumbo', '080a8a'),
-      ('eclair', '0.3.4-mpp', '028a8a'),
-      ('eclair', '0.4', '0a8a'),
-      ('eclair', '0.4-wumbo', '080a8a'),
-      ('eclair', '0.4-mpp', '028a8a'),
-      ('eclair', '0.4-mpp-wumbo', '0a8a8a'),
-      ('eclair', '0.4.1', '0a8a'),
-      ('eclair', '0.4.1-srk', '2a8a'),
-      ('eclair', '0.4.1-trmp', '080a8a'),
-      ('eclair', '0.4.1-srk-trmp-kys', '08000000082a8a'),
-      ('eclair', '0.4.2', '080a8a'),
-      ('eclair', '0.5.0', '0aaa8a'),
-      ('eclair', '0.5.0-srk-sec', '0a5a8a'),
-      ('eclair', '0.5.0-srk', '0a9a8a'),
-      ('eclair', '0.5.0-sec', '0a6a8a'),
-      ('eclair', '0.5.0-kys', '800000000aaa8a'),
-      ('eclair', '0.5.0-srk-kys', '800000000a9a8a'),
-      ('eclair', '0.5.0-trmp1', '8800000022aa8a'),
-      ('eclair', '0.5.0-trmp2', '880000002aaa8a'),
-      ('eclair', '0.5.0-trmp3', '8800000028aa8a'),
-      ('eclair', '0.5.0-trmp4', '880000002a9a8a'),
-      ('eclair', '0.5.0-trmp5', '880000002a5a8a'),
-      ('eclair', '0.5.0-trmp6', '800000002a5a89'),
-      ('eclair', '0.5.0-trmp6', '800000002aaa89'),
-      ('lnd', '0.4.1', '08'),
-      ('lnd', '0.4.2', '08'),
-      ('lnd', '0.5', '82'),
-      ('lnd', '0.5.2', '82'),
-      ('lnd', '0.6', '81'),
-      ('lnd', '0.6.1', '81'),
-      ('lnd', '0.7.1', '81'),
-      ('lnd', '0.8.0', '2281'),
-      ('lnd', '0.8.1', '2281'),
-      ('lnd', '0.8.2', '2281'),
-      ('lnd', '0.9.0', '02a2a1'),
-      ('lnd', '0.9.1', '02a2a1'),
-      ('lnd', '0.9.2', '02a2a1'),
-      ('lnd', '0.10.0', '02a2a1'),
-      ('lnd', 'probably', '0a00'),
-      ('lnd', 'guess', '2200'),
-      ('lnd', '0.11', '02a2a1'),
-      ('lnd', '0.11-wumbo', '0aa2a1'),
-      ('lnd', '0.12', '8252a1'),
-      ('lnd', '0.12-wumbo', '8a52a1'),
-      ('lnd', '0.12-noanchors', '0252a1'),
-      ('lnd', '0.12-noanchors-wumbo', '0a52a1'),
-      ('electrum', '4.0.4', 'b203')
-  ), agg AS (
-    SELECT pubkey, array_agg(daemon.name) AS impl
-    FROM features
-    INNER JOIN daemon ON features = featurebits
-    GROUP BY pubkey
-  ), counts AS (
-    SELECT pubkey,
-      (SELECT count(*) FROM unnest(impl) AS v WHERE v = 'eclair') AS eclair,
-      (SELECT count(*) FROM unnest(impl) AS v WHERE v = 'lnd') AS lnd,
-      (SELECT count(*) FROM unnest(impl) AS v WHERE v = 'c-lightning') AS clightning
-    FROM agg
-  )
-  SELECT pubkey, CASE
-    WHEN eclair > clightning AND eclair > lnd THEN 'eclair'
-    WHEN clightning > lnd THEN 'c-lightning'
-    WHEN lnd > 0 THEN 'lnd'
-  END AS implementation
-  FROM counts;
-GRANT SELECT ON implementations TO web_anon;
-
 CREATE OR REPLACE FUNCTION home_chart(since_block integer)
 RETURNS TABLE (
   blockgroup int,